@@ -1,6 +1,8 @@
 import cv2
 import pandas as pd
 import numpy as np
+from video_io import open_video, iter_frames, create_video_writer, FrameWriter
+from trajectory import simplify_trajectory
 
 def create_trajectory_video(csv_path, output_path='ball_trajectory.mp4', fps=60):
     """
@@ -20,42 +22,53 @@ def create_trajectory_video(csv_path, output_path='ball_trajectory.mp4', fps=60)
     height = int(max(df['x'].max(), df['y'].max())) + 100
     
     # 動画の初期化
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+    # H.264（使えればハードウェアエンコーダ）で書き込み、ffmpegが無ければmp4v
+    out = FrameWriter(create_video_writer(output_path, fps, (width, height)))
     
     print(f"動画サイズ: {width}x{height}")
     print(f"フレーム数: {len(df)}")
     
+    # 座標を一度だけ整数配列に変換（ループ内でのpandasアクセスを避ける）
+    pts = df[['x', 'y']].to_numpy().astype(np.int32)
+    
+    # 軌跡を間引いた頂点を一度だけ求める（ほぼ直線上の点の線分を描かずに済む）
+    is_vertex = simplify_trajectory(pts)
+    last_vertex = None
+    
+    # 軌跡を蓄積するキャンバス（頂点に達するごとに新しい線分だけを描き足す）
+    canvas = np.zeros((height, width, 3), dtype=np.uint8)
+    
+    # 出力フレームは毎回確保せず、書き込みスレッドが参照し得る数のバッファを順に使い回す
+    buffers = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(out.buffer_count)]
+    
     # 各フレームを処理
-    for i in range(len(df)):
-        # 黒い背景を作成
-        frame = np.zeros((height, width, 3), dtype=np.uint8)
-        
-        # 現在のフレームまでの軌跡を線で描画
-        points = []
-        for j in range(i + 1):
-            x = int(df.iloc[j]['x'])
-            y = int(df.iloc[j]['y'])
-            points.append((x, y))
-        
-        # 線で軌跡を描画
-        if len(points) > 1:
-            points_array = np.array(points, dtype=np.int32)
-            cv2.polylines(frame, [points_array], False, (0, 255, 0), thickness=8)
-        
-        # 現在のボール位置を黄色で強調
-        current_x = int(df.iloc[i]['x'])
-        current_y = int(df.iloc[i]['y'])
-        cv2.circle(frame, (current_x, current_y), 8, (0, 255, 255), -1)
-        
-        # フレーム番号を表示
-        cv2.putText(frame, f'Frame: {i+1}/{len(df)}', (10, 30), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        
-        out.write(frame)
-    
-    # リソースを解放
-    out.release()
+    try:
+        for i in range(len(df)):
+            # 頂点に達したら、前の頂点からの線分を軌跡に追加
+            if is_vertex[i]:
+                if i > 0:
+                    cv2.line(canvas, last_vertex, tuple(pts[i]), (0, 255, 0), thickness=8)
+                last_vertex = tuple(pts[i])
+            
+            # 軌跡のコピーに現在位置などを描画
+            frame = buffers[i % len(buffers)]
+            np.copyto(frame, canvas)
+            
+            # 最後の頂点から現在位置までの線分はこのフレームにだけ描く
+            if not is_vertex[i]:
+                cv2.line(frame, last_vertex, tuple(pts[i]), (0, 255, 0), thickness=8)
+            
+            # 現在のボール位置を黄色で強調
+            cv2.circle(frame, (int(pts[i, 0]), int(pts[i, 1])), 8, (0, 255, 255), -1)
+            
+            # フレーム番号を表示
+            cv2.putText(frame, f'Frame: {i+1}/{len(df)}', (10, 30), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+            
+            out.write(frame)
+    finally:
+        # リソースを解放（途中で例外が起きた場合も、書き込みスレッドとffmpegを終了させる）
+        out.release()
     print(f"動画が作成されました: {output_path}")
 
 def create_trajectory_overlay_video(csv_path, original_video_path=None, output_path='ball_trajectory_overlay.mp4'):
@@ -73,58 +86,84 @@ def create_trajectory_overlay_video(csv_path, original_video_path=None, output_p
     
     if original_video_path and os.path.exists(original_video_path):
         # 元動画を読み込み
-        cap = cv2.VideoCapture(original_video_path)
+        cap = open_video(original_video_path)
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         fps = cap.get(cv2.CAP_PROP_FPS)
+        # デコードは読み込みスレッドで先読みし、CSVの各行と同じフレームだけを取り出す
+        # （ボールが検出できなかったフレームはgrabで読み飛ばす）
+        frames = iter_frames(cap, frame_numbers=df['frame'] if 'frame' in df.columns else None)
     else:
         # 座標から動画サイズを決定
         width = int(df['x'].max() - df['x'].min()) + 200
         height = int(df['y'].max() - df['y'].min()) + 200
         fps = 60
+        cap = None
+        frames = None
     
-    # 動画の初期化
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+    # 動画の初期化（書き込みは別スレッド）
+    # H.264（使えればハードウェアエンコーダ）で書き込み、ffmpegが無ければmp4v
+    out = FrameWriter(create_video_writer(output_path, fps, (width, height)))
     
     print(f"動画サイズ: {width}x{height}")
     print(f"フレーム数: {len(df)}")
     
+    # 座標と画面内判定を一度だけ計算
+    pts = df[['x', 'y']].to_numpy().astype(np.int32)
+    in_bounds = np.logical_and.reduce((pts[:, 0] >= 0, pts[:, 0] < width,
+                                       pts[:, 1] >= 0, pts[:, 1] < height))
+    # 画面内の点だけを抜き出し、各フレーム時点で何点目まで見えているかを求めておく
+    valid_pts = pts[in_bounds]
+    valid_count = np.cumsum(in_bounds)
+    
+    # 画面内の軌跡を間引いた頂点を一度だけ求める
+    is_vertex = simplify_trajectory(valid_pts)
+    last_vertex = None
+    
+    # 軌跡を蓄積するキャンバスと、その描画済み領域のマスク
+    canvas = np.zeros((height, width, 3), dtype=np.uint8)
+    trail_mask = np.zeros((height, width), dtype=np.uint8)
+    
+    # 元動画が無い場合の黒背景フレームは、書き込みスレッドが参照し得る数のバッファを使い回す
+    buffers = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(out.buffer_count)]
+    
     # 各フレームを処理
-    for i in range(len(df)):
-        if original_video_path and os.path.exists(original_video_path):
-            ret, frame = cap.read()
-            if not ret:
-                frame = np.zeros((height, width, 3), dtype=np.uint8)
-        else:
-            frame = np.zeros((height, width, 3), dtype=np.uint8)
-        
-        # 軌跡を線で描画
-        points = []
-        for j in range(i + 1):
-            x = int(df.iloc[j]['x'])
-            y = int(df.iloc[j]['y'])
-            if 0 <= x < width and 0 <= y < height:
-                points.append((x, y))
-        
-        # 線で軌跡を描画
-        if len(points) > 1:
-            points_array = np.array(points, dtype=np.int32)
-            cv2.polylines(frame, [points_array], False, (0, 255, 0), thickness=6)
-        
-        # 現在のボール位置を黄色で強調
-        current_x = int(df.iloc[i]['x'])
-        current_y = int(df.iloc[i]['y'])
-        
-        if 0 <= current_x < width and 0 <= current_y < height:
-            cv2.circle(frame, (current_x, current_y), 8, (0, 255, 255), -1)
-        
-        out.write(frame)
-    
-    # リソースを解放
-    out.release()
-    if original_video_path:
-        cap.release()
+    try:
+        for i in range(len(df)):
+            decoded = next(frames, None) if frames else None
+            if decoded:
+                # デコード済みフレームはこのループ専用なので、そのまま描画先にする
+                _, frame = decoded
+            else:
+                frame = buffers[i % len(buffers)]
+                frame.fill(0)
+            
+            # 画面内の頂点に達したフレームでは、前の頂点との線分をキャンバスに追加
+            n = valid_count[i]
+            if in_bounds[i] and is_vertex[n - 1]:
+                p = tuple(valid_pts[n - 1])
+                if n > 1:
+                    cv2.line(canvas, last_vertex, p, (0, 255, 0), thickness=6)
+                    cv2.line(trail_mask, last_vertex, p, 255, thickness=6)
+                last_vertex = p
+            
+            # 蓄積した軌跡をフレームに重ね、最後の頂点から最新の画面内の点までの線分はこのフレームにだけ描く
+            cv2.copyTo(canvas, trail_mask, frame)
+            if n > 0 and not is_vertex[n - 1]:
+                cv2.line(frame, last_vertex, tuple(valid_pts[n - 1]), (0, 255, 0), thickness=6)
+            
+            # 現在のボール位置を黄色で強調
+            if in_bounds[i]:
+                cv2.circle(frame, (int(pts[i, 0]), int(pts[i, 1])), 8, (0, 255, 255), -1)
+            
+            out.write(frame)
+    finally:
+        # リソースを解放（途中で例外が起きた場合も、読み込み・書き込みのスレッドとffmpegを終了させる）
+        if frames:
+            frames.close()
+        out.release()
+        if cap:
+            cap.release()
     
     print(f"軌跡オーバーレイ動画が作成されました: {output_path}")
 
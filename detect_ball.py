@@ -1,68 +1,109 @@
 import cv2
+import csv
+import functools
+import logging
+import os
 import numpy as np
-import pandas as pd
 from typing import Tuple, Optional
+from video_io import open_video, iter_frames
+from numba_detect import NUMBA_AVAILABLE, detect_by_hsv_numba
+from detection_scale import to_original_scale, scale_kernel_size
 
-def detect_yellow_ball(frame: np.ndarray) -> Optional[Tuple[int, int]]:
+logger = logging.getLogger(__name__)
+
+# ノイズ除去用のカーネルサイズ（元の解像度での大きさ）
+MORPH_KERNEL_SIZE = 5
+
+# 黄色の色相テーブル（Numba版の検出で使用）
+YELLOW_HUE_TABLE = np.zeros(256, dtype=np.uint8)
+YELLOW_HUE_TABLE[15:36] = 255
+
+@functools.lru_cache(maxsize=None)
+def get_morph_kernel(kernel_size: int) -> np.ndarray:
+    """
+    ノイズ除去用の楕円カーネルを取得（毎フレーム作らないようにサイズごとにキャッシュ）
+    
+    Args:
+        kernel_size: カーネルサイズ
+        
+    Returns:
+        円形のボールの形を保ったままノイズを除ける楕円形のカーネル
+    """
+    return cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+
+def detect_yellow_ball(frame: np.ndarray, use_numba: bool = False,
+                       scale: float = 0.5) -> Optional[Tuple[int, int]]:
     """
     フレームから黄色いボールを検出する
     
     Args:
         frame: 入力フレーム
+        use_numba: Numba版の検出を使うか（Numbaが無い場合はOpenCV版）
+        scale: 検出前にフレームを縮小する倍率（1なら縮小しない）
         
     Returns:
         検出されたボールの中心座標 (x, y) または None
     """
+    # 縮小したフレームで検出する（重心を求めるだけなら全解像度は不要で、画素数が1/4になる）
+    if scale != 1:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    
+    # 最小面積とカーネルサイズも縮小後のフレームに合わせる
+    min_area = 50 * scale * scale
+    kernel = get_morph_kernel(scale_kernel_size(MORPH_KERNEL_SIZE, scale))
+    
+    if use_numba and NUMBA_AVAILABLE:
+        # HSV変換から重心計算までを中間マスクなしの1パスで行う
+        return to_original_scale(
+            detect_by_hsv_numba(frame, YELLOW_HUE_TABLE, (50, 255), (50, 255), min_area), scale
+        )
+    
     # HSVに変換
     hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
     
-    # 黄色の範囲を定義（複数の黄色の範囲を試す）
-    # 範囲1: より明るい黄色
-    lower_yellow1 = np.array([20, 100, 100])
-    upper_yellow1 = np.array([30, 255, 255])
-    
-    # 範囲2: より暗い黄色
-    lower_yellow2 = np.array([15, 50, 50])
-    upper_yellow2 = np.array([35, 255, 255])
+    # 黄色の範囲を定義
+    # 明るい黄色 [20-30, 100-255, 100-255] は暗い黄色の範囲に含まれるので、
+    # 両者の和集合である暗い黄色の範囲だけで1回で判定する
+    lower_yellow = np.array([15, 50, 50])
+    upper_yellow = np.array([35, 255, 255])
     
     # マスクを作成
-    mask1 = cv2.inRange(hsv, lower_yellow1, upper_yellow1)
-    mask2 = cv2.inRange(hsv, lower_yellow2, upper_yellow2)
-    mask = cv2.bitwise_or(mask1, mask2)
+    mask = cv2.inRange(hsv, lower_yellow, upper_yellow)
     
     # ノイズ除去
-    kernel = np.ones((5, 5), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    # オープン(収縮→膨張)とクローズ(膨張→収縮)を、間の膨張2回をまとめて同じバッファ上で行う
+    cv2.erode(mask, kernel, dst=mask)
+    cv2.dilate(mask, kernel, dst=mask, iterations=2)
+    cv2.erode(mask, kernel, dst=mask)
     
-    # 輪郭検出
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # 連結成分ごとの面積と重心を一度に計算
+    n, _, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
     
-    if contours:
-        # 最大の輪郭を選択
-        largest_contour = max(contours, key=cv2.contourArea)
+    if n > 1:
+        # 最大の成分を選択（ラベル0は背景）
+        largest = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
         
         # 面積が十分大きい場合のみ
-        area = cv2.contourArea(largest_contour)
-        if area > 50:  # 最小面積を設定
-            # 重心を計算
-            M = cv2.moments(largest_contour)
-            if M["m00"] != 0:
-                cx = int(M["m10"] / M["m00"])
-                cy = int(M["m01"] / M["m00"])
-                return (cx, cy)
+        if stats[largest, cv2.CC_STAT_AREA] > min_area:
+            return to_original_scale(centroids[largest], scale)
     
     return None
 
-def extract_ball_coordinates(video_path: str, output_csv: str = 'detected_ball_coordinates.csv'):
+def extract_ball_coordinates(video_path: str, output_csv: str = 'detected_ball_coordinates.csv',
+                             use_numba: bool = False, show_preview: bool = True,
+                             preview_every: int = 1, frame_step: int = 1):
     """
     動画からボールの座標を抽出してCSVに保存
     
     Args:
         video_path: 動画ファイルのパス
         output_csv: 出力CSVファイル名
+        use_numba: Numba版の検出を使うか
+        show_preview: プレビューを表示するか
+        preview_every: プレビューを処理したフレーム何枚ごとに更新するか
+        frame_step: 何フレームごとに検出するか（間のフレームは色変換を省いて読み飛ばす）
     """
-    cap = cv2.VideoCapture(video_path)
+    cap = open_video(video_path)
     
     # 動画情報を取得
     fps = cap.get(cv2.CAP_PROP_FPS)
@@ -70,63 +111,71 @@ def extract_ball_coordinates(video_path: str, output_csv: str = 'detected_ball_c
     
     print(f"動画情報: {frame_count}フレーム, FPS: {fps:.2f}")
     
-    results = []
-    frame_number = 0
+    detected = 0
     
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        frame_number += 1
-        timestamp_ms = (frame_number - 1) * (1000 / fps)
-        
-        # ボール検出
-        ball_pos = detect_yellow_ball(frame)
-        
-        if ball_pos:
-            x, y = ball_pos
-            results.append({
-                'frame': frame_number,
-                'timestamp_ms': round(timestamp_ms, 1),
-                'x': x,
-                'y': y
-            })
-            print(f"フレーム {frame_number}: ボール検出 ({x}, {y})")
-        else:
-            print(f"フレーム {frame_number}: ボール未検出")
+    # 検出結果は1行ずつCSVに書き出す（途中で止まってもそこまでの結果が残る）
+    with open(output_csv, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['frame', 'timestamp_ms', 'x', 'y'])
         
-        # プレビュー表示（オプション）
-        if ball_pos:
-            cv2.circle(frame, ball_pos, 10, (0, 255, 0), 2)
-            cv2.putText(frame, f"Frame: {frame_number}", (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-        
-        # 小さく表示（確認用）
-        small_frame = cv2.resize(frame, (540, 960))
-        cv2.imshow('Detection Preview', small_frame)
-        
-        # 'q'キーで終了
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+        # デコードは読み込みスレッドで先読みし、検出と並行させる
+        frames = iter_frames(cap, step=frame_step)
+        try:
+            # frame_step で間引く場合も、進捗とプレビューの間隔は処理したフレームの枚数で数える
+            for processed, (frame_number, frame) in enumerate(frames, 1):
+                timestamp_ms = (frame_number - 1) * (1000 / fps)
+                
+                # ボール検出
+                ball_pos = detect_yellow_ball(frame, use_numba)
+                
+                if ball_pos:
+                    x, y = ball_pos
+                    writer.writerow((frame_number, round(timestamp_ms, 1), x, y))
+                    detected += 1
+                
+                # 進捗は処理した100フレームごとに出力（毎フレームのprintは検出より遅くなることがある）
+                if processed % 100 == 0:
+                    logger.info(f"フレーム {frame_number}/{frame_count}: 検出 {detected}件")
+                
+                # プレビュー表示（オプション、処理したpreview_everyフレームごと）
+                if show_preview and processed % preview_every == 0:
+                    if ball_pos:
+                        cv2.circle(frame, ball_pos, 10, (0, 255, 0), 2)
+                        cv2.putText(frame, f"Frame: {frame_number}", (10, 30), 
+                                   cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                    
+                    # 半分のサイズで表示（確認用）
+                    small_frame = cv2.resize(frame, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+                    cv2.imshow('Detection Preview', small_frame)
+                    
+                    # 'q'キーで終了
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
+                    
+                    # ウィンドウが閉じられたら以降のプレビューを省略
+                    # （この値を取得できないバックエンドでは-1が返るので、0の場合だけ閉じられたとみなす）
+                    if cv2.getWindowProperty('Detection Preview', cv2.WND_PROP_VISIBLE) == 0:
+                        show_preview = False
+        finally:
+            # 途中で抜けた場合や例外の場合も、読み込みスレッドを止めてからVideoCaptureを解放する
+            frames.close()
     
     cap.release()
     cv2.destroyAllWindows()
     
-    # 結果をCSVに保存
-    if results:
-        df = pd.DataFrame(results)
-        df.to_csv(output_csv, index=False)
+    if detected:
         print(f"\n検出結果を {output_csv} に保存しました")
-        print(f"検出されたフレーム数: {len(df)}/{frame_count}")
+        print(f"検出されたフレーム数: {detected}/{frame_count}")
     else:
+        # 検出が無い場合はヘッダだけのCSVを残さない
+        os.remove(output_csv)
         print("ボールが検出されませんでした")
 
 def create_detection_preview(video_path: str):
     """
     検出プロセスのプレビュー版（手動確認用）
     """
-    cap = cv2.VideoCapture(video_path)
+    cap = open_video(video_path)
     
     while True:
         ret, frame = cap.read()
@@ -156,6 +205,8 @@ def create_detection_preview(video_path: str):
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
     video_file = "/Users/kashiwabaisamuto/Documents/ロトスコープ/黄色いボールを投げる.mp4"
     
     print("ボール検出を開始します...")
@@ -0,0 +1,37 @@
+from typing import Optional, Tuple
+
+def to_original_scale(point, scale: float) -> Optional[Tuple[int, int]]:
+    """
+    縮小フレーム上の座標を元の解像度の座標に戻す
+    
+    Args:
+        point: 縮小フレーム上の座標 (x, y) または None
+        scale: 縮小率
+    
+    Returns:
+        元の解像度での座標 (x, y) または None
+    """
+    if point is None:
+        return None
+    # 画素の中心同士を対応させる（cv2.resizeと同じ対応付け）
+    x, y = point
+    return (int((x + 0.5) / scale - 0.5), int((y + 0.5) / scale - 0.5))
+
+def scale_kernel_size(kernel_size: int, scale: float) -> int:
+    """
+    縮小フレームに合わせてフィルタのカーネルサイズを縮める
+    
+    元の解像度のカーネルをそのまま使うと、縮小フレーム上では実質的に 1/scale 倍の
+    大きさになり、小さなオブジェクトまで消してしまう
+    
+    Args:
+        kernel_size: 元の解像度でのカーネルサイズ
+        scale: 縮小率
+    
+    Returns:
+        縮小フレーム用のカーネルサイズ（奇数かつ3以上）。縮小しない場合や、
+        1以下（フィルタなし）の場合はそのまま
+    """
+    if scale == 1 or kernel_size <= 1:
+        return kernel_size
+    return max(3, int(kernel_size * scale) | 1)
@@ -0,0 +1,79 @@
+import numpy as np
+from typing import Tuple, Optional
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# OpenCVの8bit版BGR→HSV変換と同じ固定小数点テーブル（結果をOpenCVと一致させるため）
+_HSV_SHIFT = 12
+_SDIV_TABLE = np.zeros(256, dtype=np.int64)
+_SDIV_TABLE[1:] = np.rint((255 << _HSV_SHIFT) / np.arange(1, 256))
+_HDIV_TABLE = np.zeros(256, dtype=np.int64)
+_HDIV_TABLE[1:] = np.rint((180 << _HSV_SHIFT) / (6.0 * np.arange(1, 256)))
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True)
+    def _sum_matching_pixels(frame, hue_ok, s_min, s_max, v_min, v_max, sdiv, hdiv):
+        """HSV範囲に入る画素の座標の合計と画素数を1パスで求める"""
+        height = frame.shape[0]
+        width = frame.shape[1]
+        sum_x = 0.0
+        sum_y = 0.0
+        count = 0
+        for y in prange(height):
+            for x in range(width):
+                b = np.int64(frame[y, x, 0])
+                g = np.int64(frame[y, x, 1])
+                r = np.int64(frame[y, x, 2])
+                v = max(b, g, r)
+                if v < v_min or v > v_max:
+                    continue
+                diff = v - min(b, g, r)
+                s = (diff * sdiv[v] + (1 << (_HSV_SHIFT - 1))) >> _HSV_SHIFT
+                if s < s_min or s > s_max:
+                    continue
+                if v == r:
+                    h = g - b
+                elif v == g:
+                    h = b - r + 2 * diff
+                else:
+                    h = r - g + 4 * diff
+                h = (h * hdiv[diff] + (1 << (_HSV_SHIFT - 1))) >> _HSV_SHIFT
+                if h < 0:
+                    h += 180
+                if hue_ok[h]:
+                    sum_x += x
+                    sum_y += y
+                    count += 1
+        return sum_x, sum_y, count
+
+def detect_by_hsv_numba(frame: np.ndarray, hue_ok: np.ndarray,
+                        s_range: Tuple[int, int], v_range: Tuple[int, int],
+                        min_area: float) -> Optional[Tuple[float, float]]:
+    """
+    Numbaでフレームから指定色の重心を検出する
+    
+    HSV変換・範囲判定・重心計算を中間マスクを作らずに1回の走査で行う。
+    モルフォロジー処理は行わず、範囲内の全画素の重心を返す（最小面積がノイズ除去を兼ねる）。
+    
+    Args:
+        frame: 入力フレーム（BGR）
+        hue_ok: 色相(0-255)ごとに対象色なら非0となる256要素の配列
+        s_range: 彩度の範囲 (最小, 最大)
+        v_range: 明度の範囲 (最小, 最大)
+        min_area: 最小面積（画素数）
+    
+    Returns:
+        検出された中心座標 (x, y) または None（縮小フレーム上で使う場合に誤差が出ないよう、
+        OpenCVの連結成分の重心と同じく小数のまま返す）
+    """
+    sum_x, sum_y, count = _sum_matching_pixels(
+        frame, hue_ok, s_range[0], s_range[1], v_range[0], v_range[1],
+        _SDIV_TABLE, _HDIV_TABLE
+    )
+    if count > min_area:
+        return (sum_x / count, sum_y / count)
+    return None
@@ -0,0 +1,32 @@
+import cv2
+import numpy as np
+
+def simplify_trajectory(pts: np.ndarray, epsilon: float = 1.0) -> np.ndarray:
+    """
+    軌跡をDouglas-Peucker法で間引き、残す頂点を求める
+    
+    Args:
+        pts: 軌跡の座標 (N, 2) のint32配列
+        epsilon: 元の軌跡からの許容ずれ（ピクセル）
+    
+    Returns:
+        各点が間引き後の軌跡の頂点かどうかを表す長さNのbool配列（始点と終点は必ず頂点）
+    """
+    is_vertex = np.ones(len(pts), dtype=bool)
+    if len(pts) < 3:
+        return is_vertex
+    
+    simplified = cv2.approxPolyDP(pts.reshape(-1, 1, 2), epsilon, closed=False).reshape(-1, 2)
+    
+    # approxPolyDPは座標しか返さないので、元の点の並びを先頭から照合して頂点の位置を求める
+    is_vertex[:] = False
+    k = 0
+    for x, y in simplified:
+        while pts[k, 0] != x or pts[k, 1] != y:
+            k += 1
+        is_vertex[k] = True
+        k += 1
+    
+    # approxPolyDPは末尾の重複点や始点と同じ終点を落とすことがあるので、始点と終点は明示的に頂点にする
+    is_vertex[0] = is_vertex[-1] = True
+    return is_vertex
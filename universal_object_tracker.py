@@ -1,9 +1,19 @@
 import cv2
+import logging
 import numpy as np
 import pandas as pd
 from typing import Tuple, Optional, List, Dict
+import csv
 import json
 import os
+import multiprocessing
+from video_io import (open_video, iter_frames, iter_gpu_frames, cuda_available,
+                      create_video_writer, FrameWriter)
+from numba_detect import NUMBA_AVAILABLE, detect_by_hsv_numba
+from trajectory import simplify_trajectory
+from detection_scale import to_original_scale, scale_kernel_size
+
+logger = logging.getLogger(__name__)
 
 class ColorTracker:
     """
@@ -18,6 +28,10 @@ class ColorTracker:
             config_file: 設定ファイルのパス
         """
         self.config = self.load_config(config_file) if config_file else self.default_config()
+        self._cuda_filters = {}
+        self._morph_kernels = {}
+        self._hue_tables = {}
+        self._hue_luts = {}
         
     def default_config(self) -> Dict:
         """デフォルト設定"""
@@ -63,7 +77,10 @@ class ColorTracker:
             "detection": {
                 "min_area": 50,
                 "morphology_kernel_size": 5,
-                "blur_kernel_size": 5
+                "blur_kernel_size": 5,
+                "scale": 0.5,
+                "use_cuda": False,
+                "use_numba": False
             },
             "trajectory": {
                 "line_thickness": 6,
@@ -124,55 +141,220 @@ class ColorTracker:
         color_config = self.config["colors"][color_name]
         hsv_range = color_config["hsv_range"]
         
-        # HSVに変換
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        # 縮小したフレームで検出し、座標だけ元の解像度に戻す
+        # （最小面積とフィルタのカーネルサイズも縮小後のフレームに合わせる）
+        scale = self.config["detection"].get("scale", 1.0)
+        min_area = self.config["detection"]["min_area"] * scale * scale
+        blur_size = scale_kernel_size(self.config["detection"]["blur_kernel_size"], scale)
+        kernel_size = scale_kernel_size(self.config["detection"]["morphology_kernel_size"], scale)
+        if scale != 1:
+            if isinstance(frame, cv2.cuda_GpuMat):
+                frame = cv2.cuda.resize(frame, (0, 0), fx=scale, fy=scale,
+                                        interpolation=cv2.INTER_AREA)
+            else:
+                frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
         
-        # ガウシアンブラーでノイズ軽減
-        blur_size = self.config["detection"]["blur_kernel_size"]
-        if blur_size > 1:
-            hsv = cv2.GaussianBlur(hsv, (blur_size, blur_size), 0)
+        if (self.config["detection"].get("use_numba", False) and NUMBA_AVAILABLE
+                and isinstance(frame, np.ndarray)):
+            # Numba版: HSV変換から重心計算までを中間マスクなしの1パスで行う
+            return to_original_scale(detect_by_hsv_numba(
+                frame, self._get_hue_table(color_name, hsv_range),
+                (hsv_range[0][1], hsv_range[1][1]), (hsv_range[0][2], hsv_range[1][2]),
+                min_area
+            ), scale)
+        
+        if isinstance(frame, cv2.cuda_GpuMat):
+            # GPU上でマスクまで作成し、1チャンネルのマスクだけをCPUに転送
+            mask = self._create_mask_cuda(frame, color_name, hsv_range, blur_size, kernel_size)
+        else:
+            # HSVに変換
+            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+            
+            # カラーマスクを作成
+            lower = np.array(hsv_range[0])
+            upper = np.array(hsv_range[1])
+            
+            if color_name == "red":
+                # 赤色はHSVの境界を跨ぐので、色相をテーブルで [h_min, h_max] ∪ [170, 180]
+                # の判定結果(255/0)に置き換えてから1回のinRangeで判定する
+                lut = self._get_hue_lut(color_name, hsv_range)
+                lower[0] = upper[0] = 255
+                mask = cv2.inRange(cv2.LUT(hsv, lut), lower, upper)
+            else:
+                mask = cv2.inRange(hsv, lower, upper)
+            
+            # ノイズ除去
+            kernel = self._get_morph_kernel(kernel_size)
+            if blur_size > 1:
+                # 小さなノイズはマスクへのメディアンフィルタで除き（オープンの代わり）、
+                # クローズ(膨張→収縮)で穴を埋める
+                mask = cv2.medianBlur(mask, blur_size)
+                cv2.dilate(mask, kernel, dst=mask)
+                cv2.erode(mask, kernel, dst=mask)
+            else:
+                # オープン(収縮→膨張)とクローズ(膨張→収縮)を、間の膨張2回をまとめて同じバッファ上で行う
+                cv2.erode(mask, kernel, dst=mask)
+                cv2.dilate(mask, kernel, dst=mask, iterations=2)
+                cv2.erode(mask, kernel, dst=mask)
         
-        # カラーマスクを作成
-        lower = np.array(hsv_range[0])
-        upper = np.array(hsv_range[1])
-        mask = cv2.inRange(hsv, lower, upper)
+        # 連結成分ごとの面積と重心を一度に計算
+        n, _, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
         
-        # 赤色の場合、HSVの境界を跨ぐので特別処理
-        if color_name == "red":
-            lower_red2 = np.array([170, 100, 100])
-            upper_red2 = np.array([180, 255, 255])
-            mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-            mask = cv2.bitwise_or(mask, mask2)
-        
-        # モルフォロジー処理でノイズ除去
-        kernel_size = self.config["detection"]["morphology_kernel_size"]
-        kernel = np.ones((kernel_size, kernel_size), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-        
-        # 輪郭検出
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        if contours:
-            # 最大の輪郭を選択
-            largest_contour = max(contours, key=cv2.contourArea)
+        if n > 1:
+            # 最大の成分を選択（ラベル0は背景）
+            largest = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
             
             # 面積チェック
-            area = cv2.contourArea(largest_contour)
-            min_area = self.config["detection"]["min_area"]
-            
-            if area > min_area:
-                # 重心を計算
-                M = cv2.moments(largest_contour)
-                if M["m00"] != 0:
-                    cx = int(M["m10"] / M["m00"])
-                    cy = int(M["m01"] / M["m00"])
-                    return (cx, cy)
+            if stats[largest, cv2.CC_STAT_AREA] > min_area:
+                return to_original_scale(centroids[largest], scale)
         
         return None
     
+    def _get_morph_kernel(self, kernel_size: int) -> np.ndarray:
+        """
+        モルフォロジー処理用の楕円カーネルを取得（サイズごとにキャッシュ）
+        
+        Args:
+            kernel_size: カーネルサイズ
+            
+        Returns:
+            円形のオブジェクトの形を保ちやすい楕円形のカーネル
+        """
+        if kernel_size not in self._morph_kernels:
+            self._morph_kernels[kernel_size] = cv2.getStructuringElement(
+                cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+        return self._morph_kernels[kernel_size]
+    
+    def _get_hue_table(self, color_name: str, hsv_range: List[List[int]]) -> np.ndarray:
+        """
+        色相の判定テーブルを取得（色相範囲ごとにキャッシュ）
+        
+        Args:
+            color_name: 検出する色の名前
+            hsv_range: HSV範囲 [[h_min, s_min, v_min], [h_max, s_max, v_max]]
+            
+        Returns:
+            色相(0-255)ごとに対象色なら255、それ以外は0となる256要素の配列
+        """
+        h_min, h_max = hsv_range[0][0], hsv_range[1][0]
+        key = (h_min, h_max, color_name == "red")
+        if key not in self._hue_tables:
+            table = np.zeros(256, dtype=np.uint8)
+            table[h_min:h_max + 1] = 255
+            # 赤色の場合、HSVの境界を跨ぐので [170, 180] も含める
+            if color_name == "red":
+                table[170:181] = 255
+            self._hue_tables[key] = table
+        return self._hue_tables[key]
+    
+    def _get_hue_lut(self, color_name: str, hsv_range: List[List[int]]) -> np.ndarray:
+        """
+        cv2.LUT用の色相テーブルを取得（色相範囲ごとにキャッシュ）
+        
+        Args:
+            color_name: 検出する色の名前
+            hsv_range: HSV範囲 [[h_min, s_min, v_min], [h_max, s_max, v_max]]
+            
+        Returns:
+            色相を判定結果(255/0)に変換し、彩度・明度はそのまま残すテーブル
+        """
+        key = (hsv_range[0][0], hsv_range[1][0], color_name == "red")
+        if key not in self._hue_luts:
+            lut = np.zeros((256, 1, 3), dtype=np.uint8)
+            lut[:, 0, 0] = self._get_hue_table(color_name, hsv_range)
+            lut[:, 0, 1] = lut[:, 0, 2] = np.arange(256)
+            self._hue_luts[key] = lut
+        return self._hue_luts[key]
+    
+    def _create_mask_cuda(self, gpu_frame: cv2.cuda_GpuMat, color_name: str,
+                          hsv_range: List[List[int]], blur_size: int,
+                          kernel_size: int) -> np.ndarray:
+        """
+        GPU上のフレームからカラーマスクを作成（CUDA版）
+        
+        Args:
+            gpu_frame: GPU上のBGRフレーム
+            color_name: 検出する色の名前
+            hsv_range: HSV範囲 [[h_min, s_min, v_min], [h_max, s_max, v_max]]
+            blur_size: メディアンフィルタのカーネルサイズ（1以下なら行わない）
+            kernel_size: モルフォロジー処理のカーネルサイズ
+            
+        Returns:
+            ノイズ除去済みのマスク（CPU上）
+        """
+        # HSVに変換してカラーマスクを作成
+        gpu_hsv = cv2.cuda.cvtColor(gpu_frame, cv2.COLOR_BGR2HSV)
+        gpu_mask = cv2.cuda.inRange(gpu_hsv, tuple(hsv_range[0]), tuple(hsv_range[1]))
+        
+        # 赤色の場合、HSVの境界を跨ぐので色相 [170, 180] も判定する
+        # （彩度・明度はCPU版・Numba版と同じく設定された範囲を使う）
+        if color_name == "red":
+            gpu_mask2 = cv2.cuda.inRange(gpu_hsv, (170, *hsv_range[0][1:]), (180, *hsv_range[1][1:]))
+            gpu_mask = cv2.cuda.bitwise_or(gpu_mask, gpu_mask2)
+        
+        # ノイズ除去（フィルタはカーネルサイズごとに使い回す）
+        key = ("morphology", kernel_size)
+        if key not in self._cuda_filters:
+            kernel = self._get_morph_kernel(kernel_size)
+            self._cuda_filters[key] = (
+                cv2.cuda.createMorphologyFilter(cv2.MORPH_OPEN, cv2.CV_8UC1, kernel),
+                cv2.cuda.createMorphologyFilter(cv2.MORPH_CLOSE, cv2.CV_8UC1, kernel)
+            )
+        open_filter, close_filter = self._cuda_filters[key]
+        if blur_size > 1:
+            # 小さなノイズはメディアンフィルタで除き（オープンの代わり）、クローズで穴を埋める
+            key = ("median", blur_size)
+            if key not in self._cuda_filters:
+                self._cuda_filters[key] = cv2.cuda.createMedianFilter(cv2.CV_8UC1, blur_size)
+            gpu_mask = close_filter.apply(self._cuda_filters[key].apply(gpu_mask))
+        else:
+            gpu_mask = close_filter.apply(open_filter.apply(gpu_mask))
+        
+        return gpu_mask.download()
+    
+    def _detect_in_parallel(self, video_path: str, color_name: str, fps: float,
+                            frame_count: int, workers: int,
+                            frame_step: int = 1) -> List[Tuple[int, float, int, int]]:
+        """
+        動画をフレーム範囲ごとに分割し、複数プロセスで検出
+        
+        Args:
+            video_path: 動画ファイルのパス
+            color_name: 検出する色の名前
+            fps: フレームレート
+            frame_count: 総フレーム数
+            workers: プロセス数
+            frame_step: 何フレームごとに検出するか
+            
+        Returns:
+            フレーム順に並んだCSVの行 (frame, timestamp_ms, x, y)
+        """
+        # 最後の範囲は動画の終わりまで読む（総フレーム数は概算値のことがあるため）
+        chunk_size = max(1, -(-frame_count // workers))
+        starts = list(range(0, max(frame_count, 1), chunk_size))
+        pool_size = min(workers, len(starts))
+        # 各プロセスのデコードスレッド数は、CPUのコア数をプロセス数で分けた数にする
+        threads = max(1, (os.cpu_count() or 1) // pool_size)
+        tasks = [(self.config, video_path, color_name, start,
+                  starts[k + 1] if k + 1 < len(starts) else None, frame_step, threads)
+                 for k, start in enumerate(starts)]
+        
+        detections = []
+        # OpenCV/FFmpegのスレッドやNumbaのスレッドプールを持ったままforkすると
+        # 子プロセスが固まることがあるので、spawnで新しいプロセスを起動する
+        with multiprocessing.get_context('spawn').Pool(pool_size) as pool:
+            for done, part in enumerate(pool.imap_unordered(_detect_frame_range, tasks), 1):
+                detections.extend(part)
+                print(f"フレーム範囲 {done}/{len(tasks)} の検出が完了")
+        
+        detections.sort()
+        return [(frame_number, round((frame_number - 1) * (1000 / fps), 1), x, y)
+                for frame_number, x, y in detections]
+    
     def extract_object_coordinates(self, video_path: str, color_name: str, 
-                                 output_csv: str = None, show_preview: bool = True) -> str:
+                                 output_csv: str = None, show_preview: bool = True,
+                                 workers: int = 1, preview_every: int = 1,
+                                 frame_step: int = 1) -> str:
         """
         動画からオブジェクトの座標を抽出
         
@@ -181,6 +363,11 @@ class ColorTracker:
             color_name: 検出する色の名前
             output_csv: 出力CSVファイル名
             show_preview: プレビューを表示するか
+            workers: 検出に使うプロセス数（2以上の場合はプレビューなしで並列処理）。
+                検出プロセスはspawnで起動されるので、スクリプトから呼ぶ場合は
+                if __name__ == "__main__": の中で呼び出すこと
+            preview_every: プレビューを処理したフレーム何枚ごとに更新するか
+            frame_step: 何フレームごとに検出するか（間のフレームはデコード後の色変換を省いて読み飛ばす）
             
         Returns:
             出力CSVファイルのパス
@@ -188,7 +375,7 @@ class ColorTracker:
         if output_csv is None:
             output_csv = f"detected_{color_name}_coordinates.csv"
         
-        cap = cv2.VideoCapture(video_path)
+        cap = open_video(video_path)
         fps = cap.get(cv2.CAP_PROP_FPS)
         frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         
@@ -198,58 +385,87 @@ class ColorTracker:
         print(f"{color_name_jp}オブジェクトの検出を開始...")
         print(f"動画情報: {frame_count}フレーム, FPS: {fps:.2f}")
         
-        results = []
-        frame_number = 0
+        # NVDECが使える場合はデコードからマスク作成までGPU上で行う
+        use_cuda = self.config["detection"].get("use_cuda", False)
+        if use_cuda and not cuda_available():
+            print("CUDAが利用できないため、CPUで検出します")
+            use_cuda = False
+        if self.config["detection"].get("use_numba", False) and not NUMBA_AVAILABLE:
+            print("Numbaがインストールされていないため、OpenCVで検出します")
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            frame_number += 1
-            timestamp_ms = (frame_number - 1) * (1000 / fps)
-            
-            # オブジェクト検出
-            obj_pos = self.detect_colored_object(frame, color_name)
+        detected = 0
+        
+        # 検出結果は1行ずつCSVに書き出す（途中で止まってもそこまでの結果が残る）
+        with open(output_csv, 'w', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['frame', 'timestamp_ms', 'x', 'y'])
             
-            if obj_pos:
-                x, y = obj_pos
-                results.append({
-                    'frame': frame_number,
-                    'timestamp_ms': round(timestamp_ms, 1),
-                    'x': x,
-                    'y': y
-                })
-                print(f"フレーム {frame_number}: {color_name_jp}オブジェクト検出 ({x}, {y})")
+            if workers > 1:
+                # フレーム範囲を分割して複数プロセスで検出（プレビューは表示しない）
+                rows = self._detect_in_parallel(video_path, color_name, fps, frame_count, workers,
+                                                frame_step)
+                writer.writerows(rows)
+                detected = len(rows)
             else:
-                print(f"フレーム {frame_number}: {color_name_jp}オブジェクト未検出")
-            
-            # プレビュー表示
-            if show_preview:
-                if obj_pos:
-                    highlight_color = tuple(color_config["highlight_color"])
-                    cv2.circle(frame, obj_pos, 10, highlight_color, 2)
-                    cv2.putText(frame, f"Frame: {frame_number}", (10, 30), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 1, highlight_color, 2)
-                
-                # 小さく表示
-                small_frame = cv2.resize(frame, (540, 960))
-                cv2.imshow(f'{color_name_jp}オブジェクト検出', small_frame)
+                window_name = f'{color_name_jp}オブジェクト検出'
                 
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
+                # デコードは読み込みスレッドで先読みし、検出と並行させる
+                if use_cuda:
+                    frames = iter_gpu_frames(video_path, step=frame_step)
+                else:
+                    frames = iter_frames(cap, step=frame_step)
+                try:
+                    # frame_step で間引く場合も、進捗とプレビューの間隔は処理したフレームの枚数で数える
+                    for processed, (frame_number, frame) in enumerate(frames, 1):
+                        timestamp_ms = (frame_number - 1) * (1000 / fps)
+                        
+                        # オブジェクト検出
+                        obj_pos = self.detect_colored_object(frame, color_name)
+                        
+                        if obj_pos:
+                            x, y = obj_pos
+                            writer.writerow((frame_number, round(timestamp_ms, 1), x, y))
+                            detected += 1
+                        
+                        # 進捗は処理した100フレームごとに出力（毎フレームのprintは検出より遅くなることがある）
+                        if processed % 100 == 0:
+                            logger.info(f"フレーム {frame_number}/{frame_count}: {color_name_jp}オブジェクト検出 {detected}件")
+                        
+                        # プレビュー表示（処理したpreview_everyフレームごと）
+                        if show_preview and processed % preview_every == 0:
+                            if use_cuda:
+                                frame = frame.download()
+                            if obj_pos:
+                                highlight_color = tuple(color_config["highlight_color"])
+                                cv2.circle(frame, obj_pos, 10, highlight_color, 2)
+                                cv2.putText(frame, f"Frame: {frame_number}", (10, 30), 
+                                           cv2.FONT_HERSHEY_SIMPLEX, 1, highlight_color, 2)
+                            
+                            # 半分のサイズで表示
+                            small_frame = cv2.resize(frame, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+                            cv2.imshow(window_name, small_frame)
+                            
+                            if cv2.waitKey(1) & 0xFF == ord('q'):
+                                break
+                            
+                            # ウィンドウが閉じられたら以降のプレビューを省略
+                            # （この値を取得できないバックエンドでは-1が返るので、0の場合だけ閉じられたとみなす）
+                            if cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) == 0:
+                                show_preview = False
+                finally:
+                    # 途中で抜けた場合や例外の場合も、読み込みスレッドを止めてからVideoCaptureを解放する
+                    frames.close()
         
         cap.release()
         cv2.destroyAllWindows()
         
-        # 結果をCSVに保存
-        if results:
-            df = pd.DataFrame(results)
-            df.to_csv(output_csv, index=False)
+        if detected:
             print(f"\n検出結果を {output_csv} に保存しました")
-            print(f"検出されたフレーム数: {len(df)}/{frame_count}")
+            print(f"検出されたフレーム数: {detected}/{frame_count}")
             return output_csv
         else:
+            # 検出が無い場合はヘッダだけのCSVを残さない
+            os.remove(output_csv)
             print(f"{color_name_jp}オブジェクトが検出されませんでした")
             return None
     
@@ -284,20 +500,24 @@ class ColorTracker:
         
         if original_video_path and os.path.exists(original_video_path):
             # 元動画を読み込み
-            cap = cv2.VideoCapture(original_video_path)
+            cap = open_video(original_video_path)
             width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
             height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
             fps = cap.get(cv2.CAP_PROP_FPS)
+            # デコードは読み込みスレッドで先読みし、CSVの各行と同じフレームだけを取り出す
+            # （検出できなかったフレームはgrabで読み飛ばす）
+            frames = iter_frames(cap, frame_numbers=df['frame'] if 'frame' in df.columns else None)
         else:
             # 座標から動画サイズを決定
             width = int(df['x'].max() - df['x'].min()) + 200
             height = int(df['y'].max() - df['y'].min()) + 200
             fps = self.config["trajectory"]["fps"]
             cap = None
+            frames = None
         
-        # 動画の初期化
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+        # 動画の初期化（書き込みは別スレッド）
+        # H.264（使えればハードウェアエンコーダ）で書き込み、ffmpegが無ければmp4v
+        out = FrameWriter(create_video_writer(output_path, fps, (width, height)))
         
         track_color = tuple(color_config["track_color"])
         highlight_color = tuple(color_config["highlight_color"])
@@ -306,41 +526,71 @@ class ColorTracker:
         
         print(f"軌跡動画作成中: {width}x{height}, {len(df)}フレーム")
         
+        # 座標と画面内判定を一度だけ計算
+        pts = df[['x', 'y']].to_numpy().astype(np.int32)
+        in_bounds = np.logical_and.reduce((pts[:, 0] >= 0, pts[:, 0] < width,
+                                           pts[:, 1] >= 0, pts[:, 1] < height))
+        # 画面内の点だけを抜き出し、各フレーム時点で何点目まで見えているかを求めておく
+        valid_pts = pts[in_bounds]
+        valid_count = np.cumsum(in_bounds)
+        
+        # 画面内の軌跡を間引いた頂点を一度だけ求める
+        is_vertex = simplify_trajectory(valid_pts)
+        last_vertex = None
+        
+        # 軌跡を蓄積するキャンバスと、その描画済み領域のマスク
+        canvas = np.zeros((height, width, 3), dtype=np.uint8)
+        trail_mask = np.zeros((height, width), dtype=np.uint8)
+        
+        # 元動画が無い場合の黒背景フレームは、書き込みスレッドが参照し得る数のバッファを使い回す
+        buffers = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(out.buffer_count)]
+        num_buffers = len(buffers)
+        
+        # ループ内で使う値はローカル変数にしておく（NumPyのスカラー取り出しやtuple化、属性参照を毎フレーム行わない）
+        points = list(map(tuple, pts.tolist()))
+        valid_points = list(map(tuple, valid_pts.tolist()))
+        in_bounds = in_bounds.tolist()
+        valid_count = valid_count.tolist()
+        is_vertex = is_vertex.tolist()
+        write = out.write
+        
         # 各フレームを処理
-        for i in range(len(df)):
+        try:
+            for i in range(len(points)):
+                decoded = next(frames, None) if frames else None
+                if decoded:
+                    # デコード済みフレームはこのループ専用なので、そのまま描画先にする
+                    _, frame = decoded
+                else:
+                    frame = buffers[i % num_buffers]
+                    frame.fill(0)
+                
+                # 画面内の頂点に達したフレームでは、前の頂点との線分をキャンバスに追加
+                n = valid_count[i]
+                if in_bounds[i] and is_vertex[n - 1]:
+                    p = valid_points[n - 1]
+                    if n > 1:
+                        cv2.line(canvas, last_vertex, p, track_color, thickness=line_thickness)
+                        cv2.line(trail_mask, last_vertex, p, 255, thickness=line_thickness)
+                    last_vertex = p
+                
+                # 蓄積した軌跡をフレームに重ね、最後の頂点から最新の画面内の点までの線分はこのフレームにだけ描く
+                cv2.copyTo(canvas, trail_mask, frame)
+                if n > 0 and not is_vertex[n - 1]:
+                    cv2.line(frame, last_vertex, valid_points[n - 1], track_color, thickness=line_thickness)
+                
+                # 現在のオブジェクト位置を強調
+                if in_bounds[i]:
+                    cv2.circle(frame, points[i], circle_size, highlight_color, -1)
+                
+                write(frame)
+        finally:
+            # リソースを解放（途中で例外が起きた場合も、読み込み・書き込みのスレッドとffmpegを終了させる）
+            if frames:
+                frames.close()
+            out.release()
             if cap:
-                ret, frame = cap.read()
-                if not ret:
-                    frame = np.zeros((height, width, 3), dtype=np.uint8)
-            else:
-                frame = np.zeros((height, width, 3), dtype=np.uint8)
-            
-            # 軌跡を線で描画
-            points = []
-            for j in range(i + 1):
-                x = int(df.iloc[j]['x'])
-                y = int(df.iloc[j]['y'])
-                if 0 <= x < width and 0 <= y < height:
-                    points.append((x, y))
-            
-            # 線で軌跡を描画
-            if len(points) > 1:
-                points_array = np.array(points, dtype=np.int32)
-                cv2.polylines(frame, [points_array], False, track_color, thickness=line_thickness)
-            
-            # 現在のオブジェクト位置を強調
-            current_x = int(df.iloc[i]['x'])
-            current_y = int(df.iloc[i]['y'])
-            
-            if 0 <= current_x < width and 0 <= current_y < height:
-                cv2.circle(frame, (current_x, current_y), circle_size, highlight_color, -1)
-            
-            out.write(frame)
-        
-        # リソースを解放
-        out.release()
-        if cap:
-            cap.release()
+                cap.release()
         
         print(f"軌跡動画が作成されました: {output_path}")
         return output_path
@@ -352,6 +602,47 @@ class ColorTracker:
             hsv_range = color_config["hsv_range"]
             print(f"- {color_key}: {color_config['name']} (HSV: {hsv_range[0]}-{hsv_range[1]})")
 
+def _detect_frame_range(task: Tuple) -> List[Tuple[int, int, int]]:
+    """
+    指定したフレーム範囲でオブジェクトを検出（並列処理の各プロセスで実行）
+    
+    Args:
+        task: (設定, 動画パス, 色の名前, 開始フレーム位置, 終了フレーム位置またはNone, 検出間隔,
+               デコードスレッド数)
+        
+    Returns:
+        検出結果 (フレーム番号, x, y) のリスト
+    """
+    config, video_path, color_name, start, end, frame_step, threads = task
+    tracker = ColorTracker()
+    tracker.config = config
+    
+    # 各プロセスで動画を開き、担当範囲の先頭へシーク
+    # （CAP_PROP_POS_FRAMESによるシークの正確さはコンテナとバックエンドに依存し、
+    # 可変フレームレートやインデックスの無い動画では数フレームずれることがある）
+    cap = open_video(video_path, threads)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    
+    detections = []
+    frame_number = start
+    while end is None or frame_number < end:
+        # 検出しないフレームはgrabだけで読み飛ばす（範囲をまたいでも間隔は動画の先頭基準）
+        if not cap.grab():
+            break
+        frame_number += 1
+        if (frame_number - 1) % frame_step:
+            continue
+        ret, frame = cap.retrieve()
+        if not ret:
+            break
+        
+        obj_pos = tracker.detect_colored_object(frame, color_name)
+        if obj_pos:
+            detections.append((frame_number, obj_pos[0], obj_pos[1]))
+    
+    cap.release()
+    return detections
+
 def demo_usage():
     """使用例のデモ"""
     # トラッカー初期化
@@ -396,4 +687,5 @@ def demo_usage():
         print(f"動画ファイルが見つかりません: {video_file}")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     demo_usage()
\ No newline at end of file
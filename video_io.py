@@ -0,0 +1,285 @@
+import functools
+import itertools
+import os
+import queue
+import shutil
+import subprocess
+import threading
+from typing import Iterable, Iterator, Optional, Tuple
+
+import cv2
+import numpy as np
+
+def open_video(video_path: str, threads: Optional[int] = None) -> cv2.VideoCapture:
+    """
+    FFmpegのマルチスレッドデコードを有効にして動画を開く
+    
+    Args:
+        video_path: 動画ファイルのパス
+        threads: デコードに使うスレッド数（Noneの場合はCPUのコア数）
+        
+    Returns:
+        開いたVideoCapture
+    """
+    threads = threads or os.cpu_count() or 1
+    if hasattr(cv2, 'CAP_PROP_N_THREADS'):
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_N_THREADS, threads])
+    else:
+        # 古いOpenCVでは環境変数でFFmpegにスレッド数を渡す（利用者の設定を優先）
+        os.environ.setdefault('OPENCV_FFMPEG_CAPTURE_OPTIONS', f'threads;{threads}')
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+    
+    if not cap.isOpened():
+        # FFmpegバックエンドを持たないビルドでは既定のバックエンドで開く
+        cap = cv2.VideoCapture(video_path)
+    
+    # 内部バッファに古いフレームを溜めない（カメラやストリームで遅延の原因になる）
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return cap
+
+def iter_frames(cap: cv2.VideoCapture, prefetch: int = 8, step: int = 1,
+                frame_numbers: Optional[Iterable[int]] = None) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    別スレッドでデコードしたフレームを順番に返す
+    
+    デコードを読み込みスレッドに任せ、呼び出し側の検出・描画処理と
+    並行して実行する。OpenCVは処理中にGILを解放するのでスレッドで十分効果がある。
+    使わないフレームは cap.grab() だけで読み飛ばし、cap.retrieve() によるBGRへの変換を省く。
+    
+    Args:
+        cap: 読み込み元のVideoCapture
+        prefetch: 先読みしておくフレーム数の上限
+        step: 何フレームごとに返すか（1, 1+step, 1+2*step, ... 番目を返す）
+        frame_numbers: 返すフレーム番号（昇順）。指定した場合は step より優先
+    
+    Yields:
+        (フレーム番号, フレーム) フレーム番号は1始まり
+    """
+    targets = frame_numbers if frame_numbers is not None else itertools.count(1, step)
+    read_q = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    
+    def put(item) -> bool:
+        # 呼び出し側が途中で止めた場合に詰まらないよう、停止要求を確認しながら待つ
+        while not stop.is_set():
+            try:
+                read_q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def reader():
+        frame_number = 0
+        for target in targets:
+            # 目的のフレームまではgrabだけで進める
+            while frame_number < target:
+                if stop.is_set() or not cap.grab():
+                    put(None)  # 終端
+                    return
+                frame_number += 1
+            ret, frame = cap.retrieve()
+            if not ret or not put((frame_number, frame)):
+                break
+        put(None)  # 終端
+    
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    
+    try:
+        while True:
+            item = read_q.get()
+            if item is None:
+                break
+            yield item
+    finally:
+        # ループを途中で抜けた場合も読み込みスレッドを止めてから戻る
+        stop.set()
+        thread.join()
+
+def cuda_available() -> bool:
+    """
+    NVDECによるデコードとOpenCVのCUDAモジュールが使えるか
+    
+    Returns:
+        CUDA対応のOpenCVビルドで、GPUが1台以上あればTrue
+    """
+    if not hasattr(cv2, 'cudacodec'):
+        return False
+    try:
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except cv2.error:
+        return False
+
+def iter_gpu_frames(video_path: str, step: int = 1) -> Iterator[Tuple[int, cv2.cuda_GpuMat]]:
+    """
+    NVDECでデコードしたフレームをGPU上に置いたまま順番に返す
+    
+    Args:
+        video_path: 動画ファイルのパス
+        step: 何フレームごとに返すか（1, 1+step, 1+2*step, ... 番目を返す）
+        
+    Yields:
+        (フレーム番号, GPU上のBGRフレーム) フレーム番号は1始まり
+    """
+    reader = cv2.cudacodec.createVideoReader(video_path)
+    frame_number = 0
+    while True:
+        ret, gpu_frame = reader.nextFrame()
+        if not ret:
+            break
+        frame_number += 1
+        # デコード自体はGPU上で行われるので、間引くフレームは返さないだけにする
+        if (frame_number - 1) % step:
+            continue
+        # cudacodecの出力はBGRAなのでBGRに揃える
+        if gpu_frame.channels() == 4:
+            gpu_frame = cv2.cuda.cvtColor(gpu_frame, cv2.COLOR_BGRA2BGR)
+        yield frame_number, gpu_frame
+
+# H.264エンコーダの候補（ハードウェアエンコーダを優先し、最後はソフトウェアのlibx264）
+H264_ENCODERS = [
+    ('h264_videotoolbox', ['-b:v', '8M']),  # macOS
+    ('h264_nvenc', ['-b:v', '8M']),         # NVIDIA
+    ('h264_qsv', ['-b:v', '8M']),           # Intel
+    ('libx264', ['-preset', 'veryfast', '-crf', '18']),
+]
+
+@functools.lru_cache(maxsize=None)
+def select_h264_encoder() -> Optional[Tuple[str, Tuple[str, ...]]]:
+    """
+    この環境で実際に使えるH.264エンコーダを選ぶ（結果はプロセス内でキャッシュ）
+    
+    ffmpegに組み込まれていてもGPUが無ければ使えないので、候補ごとに1フレームだけ試しにエンコードする
+    
+    Returns:
+        (エンコーダ名, エンコーダのオプション) またはNone（ffmpegが無いか、どれも使えない場合）
+    """
+    if shutil.which('ffmpeg') is None:
+        return None
+    for encoder, options in H264_ENCODERS:
+        try:
+            result = subprocess.run(
+                ['ffmpeg', '-hide_banner', '-loglevel', 'error',
+                 '-f', 'lavfi', '-i', 'color=c=black:s=256x256', '-frames:v', '1',
+                 '-c:v', encoder, *options, '-f', 'null', '-'],
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                timeout=10
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            continue
+        if result.returncode == 0:
+            return encoder, tuple(options)
+    return None
+
+class FFmpegWriter:
+    """
+    ffmpegのサブプロセスに生のBGRフレームを渡してH.264で書き込むライタ
+    
+    cv2.VideoWriterと同じ write / release を持つので、FrameWriterでそのまま包める
+    """
+    
+    def __init__(self, output_path: str, fps: float, frame_size: Tuple[int, int],
+                 encoder: str, options: Iterable[str] = ()):
+        """
+        初期化
+        
+        Args:
+            output_path: 出力動画のパス
+            fps: フレームレート
+            frame_size: フレームのサイズ (幅, 高さ)
+            encoder: ffmpegのエンコーダ名
+            options: エンコーダのオプション
+        """
+        width, height = frame_size
+        self._proc = subprocess.Popen(
+            ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+             '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps),
+             '-i', '-',
+             # yuv420pは幅・高さが偶数である必要があるので、奇数の場合は1ピクセル足す
+             '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+             '-c:v', encoder, *options, '-pix_fmt', 'yuv420p', output_path],
+            stdin=subprocess.PIPE
+        )
+    
+    def write(self, frame: np.ndarray):
+        """フレームを書き込む"""
+        # 連続した配列ならコピーせずにそのまま渡す
+        self._proc.stdin.write(np.ascontiguousarray(frame).data)
+    
+    def release(self):
+        """入力を閉じてエンコードの完了を待つ"""
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass  # ffmpegが先に終了している場合は終了コードで報告する
+        returncode = self._proc.wait()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpegが終了コード {returncode} で終了しました")
+
+def create_video_writer(output_path: str, fps: float, frame_size: Tuple[int, int]):
+    """
+    出力動画のライタを作成
+    
+    ffmpegがあればH.264（使えればハードウェアエンコーダ）で書き込み、
+    無ければOpenCVのVideoWriter（mp4v）を使う
+    
+    Args:
+        output_path: 出力動画のパス
+        fps: フレームレート
+        frame_size: フレームのサイズ (幅, 高さ)
+        
+    Returns:
+        write / release を持つライタ
+    """
+    selected = select_h264_encoder()
+    if selected is None:
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        return cv2.VideoWriter(output_path, fourcc, fps, frame_size)
+    encoder, options = selected
+    return FFmpegWriter(output_path, fps, frame_size, encoder, options)
+
+class FrameWriter:
+    """
+    VideoWriterへの書き込みを別スレッドで行うラッパー
+    """
+    
+    def __init__(self, out: cv2.VideoWriter, queue_size: int = 8):
+        """
+        初期化
+        
+        Args:
+            out: 書き込み先のVideoWriter（またはFFmpegWriter）
+            queue_size: 書き込み待ちにできるフレーム数の上限
+        """
+        self.out = out
+        # 書き込み待ちのフレームと書き込み中の1フレームに加え、呼び出し側が描画中の
+        # 1フレームまでは同時に参照され得るので、出力バッファを使い回す場合はこの数だけ用意する
+        self.buffer_count = queue_size + 2
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            if self._error is None:
+                try:
+                    self.out.write(frame)
+                except Exception as e:
+                    self._error = e
+    
+    def write(self, frame: np.ndarray):
+        """フレームを書き込み待ちに追加（書き込み後まで frame を変更しないこと）"""
+        self._queue.put(frame)
+    
+    def release(self):
+        """残りのフレームを書き込んでVideoWriterを解放"""
+        self._queue.put(None)
+        self._thread.join()
+        self.out.release()
+        if self._error is not None:
+            raise self._error